@@ -4,58 +4,107 @@ import inspect
 import re
 import secrets
 import socket
+import threading
+import time
 import urllib.parse
-from typing import Callable, Dict, Optional, Set, Union, Type, Iterable
+from typing import (
+    Any,
+    Callable,
+    ClassVar,
+    Dict,
+    FrozenSet,
+    Optional,
+    Set,
+    Union,
+    Type,
+    Iterable,
+    Tuple,
+)
 
 import attrs
-from scapy.layers.inet import IP, UDP  # type: ignore
-from scapy.packet import Raw  # type: ignore
-from scapy.sendrecv import send  # type: ignore
 
 import opensettlenet_common.validators
 from opensettlenet_common import utils
 
 
+@functools.cache
+def _get_udp_socket() -> socket.socket:
+    # One socket is shared by every message sent from this process
+    return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+
+# `gethostbyname` doesn't expose record TTLs, so resolved IPs are kept for a fixed time
+_RESOLVE_TTL = 60.0
+_RESOLVE_CACHE_SIZE = 256
+_RESOLVE_CACHE: Dict[str, Tuple[float, str]] = {}
+_RESOLVE_LOCK = threading.Lock()
+
+
+def _resolve(domain: str) -> str:
+    now = time.monotonic()
+    with _RESOLVE_LOCK:
+        cached = _RESOLVE_CACHE.pop(domain, None)
+        if cached is not None and cached[0] > now:
+            # Re-inserting keeps the cache ordered from least to most recently used
+            _RESOLVE_CACHE[domain] = cached
+            return cached[1]
+    # Don't hold the lock during the (blocking) lookup itself
+    ip = socket.gethostbyname(domain)
+    with _RESOLVE_LOCK:
+        _RESOLVE_CACHE.pop(domain, None)
+        if len(_RESOLVE_CACHE) >= _RESOLVE_CACHE_SIZE:
+            # Evict the least recently used domain
+            del _RESOLVE_CACHE[next(iter(_RESOLVE_CACHE))]
+        _RESOLVE_CACHE[domain] = (now + _RESOLVE_TTL, ip)
+    return ip
+
+
 class Header:
     @staticmethod
     def header(name: str, priority: Optional[Union[int, float]] = None) -> Callable:
         def _header(method: Callable) -> Callable:
-            method_returns = inspect.signature(method).return_annotation
+            method_returns = method.__annotations__.get(
+                "return", inspect.Signature.empty
+            )
             if method_returns != str and method_returns != Optional[str]:
                 raise ValueError(
                     f"Cannot define a method for header {name} returning a type "
                     f"other than `str`, `None`, or `Optional[str]`"
                 )
 
-            @functools.wraps(method)
-            def _method(*args, **kwargs):
-                return_value = method(*args, **kwargs)
-                if type(return_value) not in (str, type(None)):
-                    raise ValueError(
-                        f"Method for header {name} returned {return_value} of type {type(return_value)}, "
-                        f"which is neither `str` nor `None`"
-                    )
-                return return_value
-
-            _method._header_name = name  # type: ignore
-            _method._header_priority = priority  # type: ignore
-            return _method
+            method._header_name = name  # type: ignore
+            method._header_priority = priority  # type: ignore
+            return method
 
         return _header
 
     @classmethod
-    def _get_headers(cls, instance: object) -> Dict[str, Optional[str]]:
-        headers = [
-            header
-            for (_, header) in inspect.getmembers(instance, predicate=inspect.ismethod)
-            if getattr(header, "_header_name", None)
-        ]
+    def _build_header_spec(cls, klass: type) -> Tuple[Tuple[str, str], ...]:
+        methods: Dict[str, Any] = {}
+        for base in klass.__mro__:
+            for attrname, value in vars(base).items():
+                # The most-derived definition wins, whether or not it's a header
+                methods.setdefault(attrname, value)
+        # Sort by name first so that ties in priority are broken alphabetically
+        headers = sorted(
+            (attrname, method)
+            for attrname, method in methods.items()
+            if callable(method) and getattr(method, "_header_name", None)
+        )
         headers.sort(
-            key=lambda header: header._header_priority  # type: ignore
-            if header._header_priority is not None  # type: ignore
+            key=lambda header: header[1]._header_priority
+            if header[1]._header_priority is not None
             else float("inf")
         )
-        return {header._header_name: header() for header in headers}  # type: ignore
+        return tuple((method._header_name, attrname) for attrname, method in headers)
+
+    @classmethod
+    def _get_headers(cls, instance: object) -> Dict[str, Optional[str]]:
+        # SIP messages resolve their spec once, when their class is created
+        spec = getattr(type(instance), "_HEADER_SPEC", None)
+        if spec is None:
+            spec = cls._build_header_spec(type(instance))
+        return {name: getattr(instance, attrname)() for name, attrname in spec}
 
     @classmethod
     def get_headers(cls, instance: object) -> Dict[str, str]:
@@ -66,14 +115,51 @@ class Header:
         }
 
 
-@attrs.define(auto_attribs=True, kw_only=True)
-class SIPURI:
+# Matches any character that `urllib.parse.quote` (with its default `safe="/"`) escapes
+_NEEDS_QUOTING = re.compile(r"[^A-Za-z0-9_.\-~/]")
+
+
+def _quote(string: str) -> str:
+    # Most users and domains don't need escaping, and `quote` is slow to find that out
+    return (
+        urllib.parse.quote(string)
+        if _NEEDS_QUOTING.search(string) is not None
+        else string
+    )
+
+
+class _StrCache:
+    # Caches live in plain slots rather than attrs fields, so that they're left out of
+    # `__eq__`, `__repr__`, `attrs.asdict()` / `attrs.astuple()`, copies and pickles.
+    # They're unset until first used, so read them with `getattr(..., None)`.
+    # (mypy's attrs plugin doesn't see slots inherited by attrs classes, hence the
+    # `type: ignore`s where they're assigned.)
+    __slots__ = ("_cached_str",)
+    _cached_str: Optional[str]
+
+
+def _clear_cached_str(instance, attribute, value):
+    # Any assignment to a field may change the formatted string
+    object.__setattr__(instance, "_cached_str", None)
+    return value
+
+
+def _freeze_parameters(parameters: Iterable[str]) -> FrozenSet[str]:
+    return frozenset(parameters)
+
+
+_ON_SETATTR = [attrs.setters.convert, attrs.setters.validate, _clear_cached_str]
+
+
+@attrs.define(auto_attribs=True, kw_only=True, slots=True, on_setattr=_ON_SETATTR)
+class SIPURI(_StrCache):
     PATTERN = re.compile(
         r"^(?:sip:)?"  # Optional "sip:" scheme
         r"(?:([^@;:>]+)@)?"  # Optional user
         r"([^@;:]+)"  # Domain
         r"(?:[:]([0-9]+))?"  # Optional port
-        r"(;.*)?$"  # Optional parameters
+        r"(;.*)?$",  # Optional parameters
+        re.ASCII,
     )
 
     domain: str = attrs.field(validator=opensettlenet_common.validators.domain)
@@ -84,23 +170,31 @@ class SIPURI:
             attrs.validators.and_(attrs.validators.ge(0), attrs.validators.le(65535))
         ),
     )
-    parameters: Set[str] = attrs.field(factory=set)
+    # Immutable, so that changing the parameters always goes through `on_setattr`
+    parameters: FrozenSet[str] = attrs.field(
+        factory=frozenset, converter=_freeze_parameters
+    )
 
     def __str__(self) -> str:
+        cached_str = getattr(self, "_cached_str", None)
+        if cached_str is not None:
+            return cached_str
         uri = self.domain
         if self.port is not None:
-            uri = f"{urllib.parse.quote(uri)}:{self.port}"
+            uri = f"{_quote(uri)}:{self.port}"
         if self.user is not None:
-            uri = f"{urllib.parse.quote(self.user)}@{uri}"
+            uri = f"{_quote(self.user)}@{uri}"
         if self.parameters:
             parameters = ";".join(self.parameters)
             uri = f"{uri};{parameters}"
-        return f"sip:{uri}"
+        uri = f"sip:{uri}"
+        self._cached_str = uri  # type: ignore
+        return uri
 
     def for_start_line(self) -> str:
         uri = self.domain
         if self.user is not None:
-            uri = f"{urllib.parse.quote(self.user)}@{uri}"
+            uri = f"{_quote(self.user)}@{uri}"
         return f"sip:{uri}"
 
     def get_domain(self) -> str:
@@ -113,7 +207,7 @@ class SIPURI:
         return self.user
 
     def add_parameter(self, parameter: str):
-        self.parameters.add(parameter)
+        self.parameters = self.parameters | {parameter}
 
     @classmethod
     def from_uri(
@@ -123,26 +217,47 @@ class SIPURI:
         if match is None:
             raise ValueError(f"SIP URI {uri!r} does not match pattern {cls.PATTERN}")
         (user, domain, port, packed_parameters) = match.groups()
+        return cls._from_groups(
+            user, domain, port, packed_parameters, additional_parameters
+        )
+
+    @classmethod
+    def _from_groups(
+        cls,
+        user: Optional[str],
+        domain: str,
+        port: Optional[str],
+        packed_parameters: Optional[str],
+        additional_parameters: Optional[Iterable[str]] = None,
+    ) -> "SIPURI":
         return cls(
             domain=domain,
             user=user,
             port=int(port) if port is not None else None,
-            parameters={
-                parameter for parameter in packed_parameters.split(";") if parameter
-            }
+            parameters=frozenset(filter(None, packed_parameters.split(";")))
             | (
-                set(additional_parameters)
+                frozenset(additional_parameters)
                 if additional_parameters is not None
-                else set()
+                else frozenset()
             )
             if packed_parameters
-            else set(),
+            else frozenset(),
         )
 
 
-@attrs.define(auto_attribs=True, kw_only=True)
+@attrs.define(auto_attribs=True, kw_only=True, slots=True)
 class Address:
-    PATTERN = re.compile(r"""(?:\s*|"(.+)"\s+|(.+))<sip:([^>]+)>(;.*)?""")
+    # The URI is parsed in the same pass, with the same groups as `SIPURI.PATTERN`
+    PATTERN = re.compile(
+        r"""(?:\s*|"(?P<quoted_display_name>.+)"\s+|(?P<display_name>.+))"""
+        r"<sip:(?:sip:)?"
+        r"(?:(?P<user>[^@;:>]+)@)?"
+        r"(?P<domain>[^@;:>]+)"
+        r"(?:[:](?P<port>[0-9]+))?"
+        r"(?P<uri_parameters>;[^>\r\n]*)?>"  # Never across a line break
+        r"(?P<parameters>;.*)?",
+        re.ASCII,
+    )
     sip_uri: SIPURI
     display_name: Optional[str] = None
     parameters: Set[str] = attrs.field(factory=set)
@@ -166,40 +281,54 @@ class Address:
     def from_address(cls, address: str) -> "Address":
         match = cls.PATTERN.match(address)
         if match:
-            (
-                quoted_display_name,
-                unquoted_display_name,
-                uri,
-                packed_parameters,
-            ) = match.groups()
-            display_name = quoted_display_name or unquoted_display_name
-            sip_uri = SIPURI.from_uri(uri)
+            display_name = match["quoted_display_name"] or match["display_name"]
+            sip_uri = SIPURI._from_groups(
+                match["user"], match["domain"], match["port"], match["uri_parameters"]
+            )
+            packed_parameters = match["parameters"]
+        elif "<" in address:
+            # A malformed bracketed URI mustn't be reparsed as a bare one
+            raise ValueError(
+                f"Address {address!r} does not match pattern {cls.PATTERN}"
+            )
         else:
             sip_uri = SIPURI.from_uri(address)  # Hopefully.
             display_name, packed_parameters = None, None
         return cls(
             display_name=display_name,
             sip_uri=sip_uri,
-            parameters={
-                parameter for parameter in packed_parameters.split(";") if parameter
-            }
+            parameters=set(filter(None, packed_parameters.split(";")))
             if packed_parameters
             else set(),
         )
 
 
-@attrs.define(auto_attribs=True, kw_only=True)
-class SIP(abc.ABC):
-    to_field: Address = attrs.field(
-        converter=lambda field: Address.from_address(field)
-        if not isinstance(field, Address)
-        else field
-    )
-    from_field: Address = attrs.field(
-        converter=lambda field: Address.from_address(field)
-        if not isinstance(field, Address)
-        else field
-    )
+def _encoded_length(body: str) -> int:
+    # An ASCII string's length in characters is its UTF-8 length in bytes
+    return len(body) if body.isascii() else len(body.encode("utf-8"))
+
+
+def _coerce_address(field: Union[str, Address]) -> Address:
+    return field if isinstance(field, Address) else Address.from_address(field)
+
+
+class _SIPCache:
+    # Plain slots for the same reasons as `_StrCache`. `_format_body_length` is the
+    # body's length in bytes for the duration of a `format()` call, so that the body
+    # is only generated once per message.
+    __slots__ = ("_format_body_length", "_cached_host_ip")
+    _format_body_length: Optional[int]
+    _cached_host_ip: Optional[str]
+
+
+@attrs.define(auto_attribs=True, kw_only=True, slots=True)
+class SIP(_SIPCache, abc.ABC):
+    # (header name, method name) pairs in the order they're formatted, resolved once
+    # per subclass when it's created
+    _HEADER_SPEC: ClassVar[Tuple[Tuple[str, str], ...]] = ()
+
+    to_field: Address = attrs.field(converter=_coerce_address)
+    from_field: Address = attrs.field(converter=_coerce_address)
 
     call_id: str
     cseq: str
@@ -219,6 +348,10 @@ class SIP(abc.ABC):
     src_ip: Optional[str] = None
     src_port: Optional[int] = None
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._HEADER_SPEC = Header._build_header_spec(cls)
+
     @abc.abstractmethod
     def method(self) -> str:
         pass
@@ -237,8 +370,11 @@ class SIP(abc.ABC):
 
     @Header.header("Content-Length", priority=float("inf"))
     def content_length_header(self) -> Optional[str]:
+        body_length = getattr(self, "_format_body_length", None)
+        if body_length is not None:
+            return str(body_length)
         body = self.get_body()
-        return str(len(body.encode("utf-8"))) if body is not None else "0"
+        return str(_encoded_length(body)) if body is not None else "0"
 
     @Header.header("Content-Type", priority=6)
     def content_type_header(self) -> Optional[str]:
@@ -287,24 +423,37 @@ class SIP(abc.ABC):
         return Header.get_headers(self)
 
     def format_headers(self) -> str:
+        # `str.join` is faster given a list than a generator
         return "".join(
-            f"{key}: {value}\r\n" for key, value in self.get_headers().items()
+            [
+                f"{name}: {value}\r\n"
+                for name, attrname in self._HEADER_SPEC
+                if (value := getattr(self, attrname)()) is not None
+            ]
         )
 
     def get_start_line(self) -> str:
         return f"{self.method()} {self.to_field.sip_uri.for_start_line()} SIP/2.0"
 
     def format(self) -> str:
-        start_line = self.get_start_line()
-        headers = self.format_headers()
         body = self.get_body()
+        body_length = _encoded_length(body) if body is not None else 0
+        self._format_body_length = body_length  # type: ignore
+        try:
+            start_line = self.get_start_line()
+            headers = self.format_headers()
+        finally:
+            self._format_body_length = None  # type: ignore
         if body is not None:
             return f"{start_line}\r\n{headers}\r\n{body}"
         else:
             return f"{start_line}\r\n{headers}\r\n"
 
     def get_host_ip(self) -> str:
-        return utils.get_host_ip()
+        host_ip = getattr(self, "_cached_host_ip", None)
+        if host_ip is None:
+            host_ip = self._cached_host_ip = utils.get_host_ip()  # type: ignore
+        return host_ip
 
     def get_host_port(self) -> int:
         return 5060
@@ -316,15 +465,13 @@ class SIP(abc.ABC):
         return self.src_port if self.src_port is not None else 5060
 
     def send_msg(self, ip: Optional[str] = None, port: Optional[int] = None):
-        pkt = (
-            IP(
-                src=self.get_host_ip(),
-                dst=ip or socket.gethostbyname(self.to_field.sip_uri.get_domain()),
-            )
-            / UDP(dport=port or self.to_field.sip_uri.get_port())
-            / Raw(load=self.format())
+        _get_udp_socket().sendto(
+            self.format().encode("utf-8"),
+            (
+                ip or _resolve(self.to_field.sip_uri.get_domain()),
+                port or self.to_field.sip_uri.get_port(),
+            ),
         )
-        send(pkt)
 
     def add_to_tag(self) -> str:
         self.to_tag = secrets.token_hex(10)
@@ -340,29 +487,43 @@ class SIP(abc.ABC):
         return new_cseq
 
 
-@attrs.define(auto_attribs=True, kw_only=True)
+@attrs.define(auto_attribs=True, kw_only=True, slots=True)
 class Subscribe(SIP):
+    METHOD: ClassVar[str] = "SUBSCRIBE"
+
     accept: Optional[str] = "application/xml"
 
     def method(self) -> str:
-        return "SUBSCRIBE"
+        return self.METHOD
 
     def get_body(self) -> Optional[str]:
         return None  # SUBSCRIBE can't have a body
 
+    @Header.header("Content-Length", priority=float("inf"))
+    def content_length_header(self) -> Optional[str]:
+        return "0"
+
+    @Header.header("Content-Type", priority=6)
+    def content_type_header(self) -> Optional[str]:
+        return None
 
-@attrs.define(auto_attribs=True, kw_only=True)
+
+@attrs.define(auto_attribs=True, kw_only=True, slots=True)
 class Publish(SIP):
+    METHOD: ClassVar[str] = "PUBLISH"
+
     accept: str = "application/xml"
     content_type: str = "application/xml"
 
     def method(self) -> str:
-        return "PUBLISH"
+        return self.METHOD
 
 
-@attrs.define(auto_attribs=True)
+@attrs.define(auto_attribs=True, slots=True)
 class Notify(SIP):
+    METHOD: ClassVar[str] = "NOTIFY"
+
     content_type: str = "application/xml"
 
     def method(self) -> str:
-        return "NOTIFY"
+        return self.METHOD
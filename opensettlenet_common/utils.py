@@ -1,34 +1,43 @@
+import functools
 import re
 import socket
-from typing import Dict
+from typing import Dict, Union
 
 HEADER_LINE = re.compile(r"^([a-zA-Z0-9-]+):\s*(.*)$")
 
 
+# A process's hostname (and the address it resolves to) doesn't change while it runs
+@functools.cache
 def get_hostname() -> str:
     return socket.gethostname()
 
 
+@functools.cache
 def get_host_ip() -> str:
     return socket.gethostbyname(get_hostname())
 
 
-def sip_headers_to_dict(packet) -> Dict[str, str]:
+def sip_headers_to_dict(packet: Union[str, bytes]) -> Dict[str, str]:
     # All SIP packets contain a double CRLF between the start line / headers & the body (even if it's empty)
-    preface, *_ = packet.split("\r\n\r\n")
+    if isinstance(packet, bytes):
+        # Raw packets only need their start line & headers decoded, not their body
+        end = packet.find(b"\r\n\r\n")
+        packet = packet[: end if end != -1 else len(packet)].decode("utf-8")
+    end = packet.find("\r\n\r\n")
     # The start line & headers (if there are any) are all separated by CRLFs
-    [_, *headers] = preface.split("\r\n")
     header_dict = {}
-    for header in headers:
+    for header in packet[: end if end != -1 else len(packet)].split("\r\n")[1:]:
         match = HEADER_LINE.match(header)
-        if match is None:
+        # A stray CR or LF would let a value smuggle in another header once it's copied
+        # into a response, so reject those outright
+        if match is None or "\n" in header or "\r" in header:
             raise ValueError(f"{header!r} is not a valid SIP header")
         header_key, header_value = match.groups()
         header_dict[header_key] = header_value
     return header_dict
 
 
-def generate_200_ok_response(packet) -> str:
+def generate_200_ok_response(packet: Union[str, bytes]) -> str:
     headers = sip_headers_to_dict(packet)
 
     response = (
@@ -1,10 +1,24 @@
-import validators  # type: ignore
+import functools
+
+
+# The same handful of peers' domains get validated over and over
+@functools.lru_cache(maxsize=1024)
+def _is_valid_sip_domain(value: str) -> bool:
+    # `validators` is slow to import, and (thanks to the cache) rarely needed
+    import validators  # type: ignore
+
+    # Only an IPv6 address can contain a colon, and only an IPv4 address or a domain can
+    # start with a digit, so there's no need to try every validator on every value
+    if ":" in value:
+        return bool(validators.ipv6(value))
+    elif value[:1].isdigit():
+        return bool(validators.ipv4(value) or validators.domain(value))
+    else:
+        return bool(validators.domain(value))
 
 
 def domain(instance, attribute, value):
-    if (
-        not validators.domain(value)
-        and not validators.ipv4(value)
-        and not validators.ipv6(value)
-    ):
+    # Anything but a string (e.g. None, or an unhashable list) can't be a domain, and
+    # can't be looked up in the cache either
+    if not isinstance(value, str) or not _is_valid_sip_domain(value):
         raise ValueError(f"{value!r} is not a valid SIP domain")
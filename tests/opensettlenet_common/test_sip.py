@@ -1,6 +1,11 @@
+import pickle
+import socket
+
+import attrs
 import pytest
 
-from opensettlenet_common.sip import SIPURI, Address, SIP
+from opensettlenet_common import sip
+from opensettlenet_common.sip import SIPURI, Address, SIP, Subscribe, Publish, Notify
 
 
 class TestSIPURI:
@@ -37,6 +42,15 @@ class TestSIPURI:
         assert sip_uri.port is None
         assert sip_uri.parameters == set()
 
+    def test_slots(self):
+        sip_uri = SIPURI.from_uri(self.valid_uri)
+        assert not hasattr(sip_uri, "__dict__")
+
+    @pytest.mark.parametrize("domain", [None, 123, ["domain.com"]])
+    def test_non_str_domain_invalid(self, domain):
+        with pytest.raises(ValueError):
+            SIPURI(domain=domain)
+
 
 class TestAddress:
     valid_address_with_display = '"John Doe" <sip:john@doe.com:5060>;param1=value1'
@@ -67,6 +81,22 @@ class TestAddress:
         with pytest.raises(ValueError):
             Address.from_address(self.invalid_address)
 
+    @pytest.mark.parametrize(
+        "address", ["example.com;<sip:bad:port>", "bob.com;x <sip:@>"]
+    )
+    def test_from_address_malformed_bracketed_uri(self, address):
+        with pytest.raises(ValueError):
+            Address.from_address(address)
+
+    @pytest.mark.parametrize("line_break", ["\r\n", "\n", "\r"])
+    def test_from_address_line_break_in_uri_parameters(self, line_break):
+        with pytest.raises(ValueError):
+            Address.from_address(f'"Bob" <sip:bob@x.com;lr{line_break}Evil: injected>')
+
+    def test_slots(self):
+        address = Address.from_address(self.valid_address_with_display)
+        assert not hasattr(address, "__dict__")
+
     # Test the `__str__` method
     def test_str_with_display_name_and_params(self):
         address = Address.from_address(self.valid_address_with_display)
@@ -88,6 +118,45 @@ class TestAddress:
         address = Address.from_address(self.valid_address_no_params)
         address.add_parameter_to_uri("uriparam=urivalue")
         assert "uriparam=urivalue" in address.sip_uri.parameters
+        assert str(address) == '"John Doe" <sip:john@doe.com:5060;uriparam=urivalue>'
+
+    def test_parameters_cannot_go_stale(self):
+        address = Address.from_address(self.valid_address_with_display)
+        assert str(address) == self.valid_address_with_display
+        # The URI's parameters can't be changed in place behind its cached string's back
+        with pytest.raises(AttributeError):
+            address.sip_uri.parameters.clear()  # type: ignore
+        address.sip_uri.parameters = {"uriparam=urivalue"}  # type: ignore
+        assert address.sip_uri.parameters == frozenset({"uriparam=urivalue"})
+        # The address's own parameters stay a mutable set
+        address.parameters.clear()
+        address.parameters.add("newparam=newvalue")
+        assert (
+            str(address)
+            == '"John Doe" <sip:john@doe.com:5060;uriparam=urivalue>;newparam=newvalue'
+        )
+
+    def test_caches_not_serialized(self):
+        address = Address.from_address(self.valid_address_with_display)
+        str(address)
+        assert attrs.asdict(address) == {
+            "sip_uri": {
+                "domain": "doe.com",
+                "user": "john",
+                "port": 5060,
+                "parameters": frozenset(),
+            },
+            "display_name": "John Doe",
+            "parameters": {"param1=value1"},
+        }
+        assert str(pickle.loads(pickle.dumps(address))) == str(address)
+
+    def test_str_after_mutation(self):
+        address = Address.from_address(self.valid_address_with_display)
+        assert str(address) == self.valid_address_with_display
+        address.display_name = "Jane Doe"
+        address.sip_uri.user = "jane"
+        assert str(address) == '"Jane Doe" <sip:jane@doe.com:5060>;param1=value1'
 
 
 class TestSIP:
@@ -183,3 +252,113 @@ class TestSIP:
             "\r\n"
             "SIP BODY"
         )
+
+    def test_content_length_non_ascii_body(self):
+        # noinspection PyTypeChecker
+        subclassed = self.SubclassedSIP(
+            to_field='"Linus Mixson" <sip:linus@opensettlenet.com>',
+            from_field='"Nigel Daniels" <sip:nigel@opensettlenet.com>',
+            call_id="4e8c8a35-3c35-4e24-a227-528ca2294f79",
+            cseq="1",
+            max_forwards="70",
+            body="SIP BÖDY",
+        )
+        assert subclassed.content_length_header() == "9"
+        assert "Content-Length: 9\r\n" in subclassed.format()
+
+    @pytest.mark.parametrize(
+        "cseq, expected",
+        [("1", 2), ("0", 1), ("314159", 314160), ("199", 200), ("007", 8)],
+    )
+    def test_increment_cseq(self, cseq, expected):
+        # noinspection PyTypeChecker
+        subclassed = self.SubclassedSIP(
+            to_field='"Linus Mixson" <sip:linus@opensettlenet.com>',
+            from_field='"Nigel Daniels" <sip:nigel@opensettlenet.com>',
+            call_id="4e8c8a35-3c35-4e24-a227-528ca2294f79",
+            cseq=cseq,
+            max_forwards="70",
+        )
+        assert subclassed.increment_cseq() == expected
+        assert subclassed.cseq == str(expected)
+
+    def test_send_msg(self):
+        # noinspection PyTypeChecker
+        subclassed = self.SubclassedSIP(
+            to_field='"Linus Mixson" <sip:linus@opensettlenet.com>',
+            from_field='"Nigel Daniels" <sip:nigel@opensettlenet.com>',
+            call_id="4e8c8a35-3c35-4e24-a227-528ca2294f79",
+            cseq="1",
+            max_forwards="70",
+            contact="sip:admin@opensettlenet.com",
+            body="SIP BODY",
+        )
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as receiver:
+            receiver.bind(("127.0.0.1", 0))
+            receiver.settimeout(5)
+            _, port = receiver.getsockname()
+            subclassed.send_msg(ip="127.0.0.1", port=port)
+            assert receiver.recv(65535) == subclassed.format().encode("utf-8")
+
+
+@pytest.mark.parametrize(
+    "cls, method", [(Subscribe, "SUBSCRIBE"), (Publish, "PUBLISH"), (Notify, "NOTIFY")]
+)
+def test_sip_subclasses(cls, method):
+    # noinspection PyTypeChecker
+    message = cls(
+        to_field='"Linus Mixson" <sip:linus@opensettlenet.com>',
+        from_field='"Nigel Daniels" <sip:nigel@opensettlenet.com>',
+        call_id="4e8c8a35-3c35-4e24-a227-528ca2294f79",
+        cseq="1",
+        max_forwards="70",
+        src_ip="127.0.0.1",
+    )
+    assert message.method() == method
+    assert message.cseq_header() == f"1 {method}"
+    # Messages are slotted, so they shouldn't carry an instance `__dict__`
+    assert not hasattr(message, "__dict__")
+    message.format()
+    assert not any(key.startswith("_") for key in attrs.asdict(message))
+
+
+def test_subscribe_has_no_body():
+    # noinspection PyTypeChecker
+    subscribe = Subscribe(
+        to_field='"Linus Mixson" <sip:linus@opensettlenet.com>',
+        from_field='"Nigel Daniels" <sip:nigel@opensettlenet.com>',
+        call_id="4e8c8a35-3c35-4e24-a227-528ca2294f79",
+        cseq="1",
+        max_forwards="70",
+        content_type="application/xml",
+        body="SIP BODY",
+    )
+    headers = subscribe.get_headers()
+    assert headers["Content-Length"] == "0"
+    assert "Content-Type" not in headers
+    assert subscribe.format().endswith("Content-Length: 0\r\n\r\n")
+
+
+def test_resolve_caches_until_ttl(mocker):
+    mocker.patch.dict(sip._RESOLVE_CACHE, clear=True)
+    gethostbyname = mocker.patch("socket.gethostbyname", return_value="10.0.0.1")
+    monotonic = mocker.patch("time.monotonic", return_value=1000.0)
+    assert sip._resolve("resolve.opensettlenet.com") == "10.0.0.1"
+    assert sip._resolve("resolve.opensettlenet.com") == "10.0.0.1"
+    assert gethostbyname.call_count == 1
+
+    monotonic.return_value += sip._RESOLVE_TTL
+    assert sip._resolve("resolve.opensettlenet.com") == "10.0.0.1"
+    assert gethostbyname.call_count == 2
+
+
+def test_resolve_evicts_least_recently_used(mocker):
+    mocker.patch.dict(sip._RESOLVE_CACHE, clear=True)
+    mocker.patch.object(sip, "_RESOLVE_CACHE_SIZE", 2)
+    gethostbyname = mocker.patch("socket.gethostbyname", return_value="10.0.0.1")
+    sip._resolve("a.opensettlenet.com")
+    sip._resolve("b.opensettlenet.com")
+    sip._resolve("a.opensettlenet.com")
+    sip._resolve("c.opensettlenet.com")
+    assert list(sip._RESOLVE_CACHE) == ["a.opensettlenet.com", "c.opensettlenet.com"]
+    assert gethostbyname.call_count == 3
@@ -1,3 +1,5 @@
+import pytest
+
 from opensettlenet_common.utils import (
     get_hostname,
     get_host_ip,
@@ -6,6 +8,16 @@ from opensettlenet_common.utils import (
 )
 
 
+@pytest.fixture(autouse=True)
+def clear_host_caches():
+    get_hostname.cache_clear()
+    get_host_ip.cache_clear()
+    yield
+    # Don't leak mocked results into tests that run later
+    get_hostname.cache_clear()
+    get_host_ip.cache_clear()
+
+
 def test_get_hostname(mocker):
     mocker.patch("socket.gethostname", return_value="test_hostname")
     hostname = get_hostname()
@@ -24,6 +36,13 @@ def test_get_host_ip(mocker):
     assert ip == "127.0.0.1"
 
 
+def test_get_host_ip_is_cached(mocker):
+    mocker.patch("socket.gethostname", return_value="localhost")
+    gethostbyname = mocker.patch("socket.gethostbyname", return_value="127.0.0.1")
+    assert get_host_ip() == get_host_ip() == "127.0.0.1"
+    assert gethostbyname.call_count == 1
+
+
 def test_sip_headers_to_dict(shared_datadir):
     with open(shared_datadir / "sip" / "ACK.bin", "rb") as fh:
         headers = sip_headers_to_dict(fh.read().decode("utf-8"))
@@ -52,6 +71,29 @@ def test_sip_headers_to_dict(shared_datadir):
         }
 
 
+def test_sip_headers_to_dict_bytes(shared_datadir):
+    with open(shared_datadir / "sip" / "INVITE.bin", "rb") as fh:
+        packet = fh.read()
+        assert sip_headers_to_dict(packet) == sip_headers_to_dict(
+            packet.decode("utf-8")
+        )
+
+
+def test_sip_headers_to_dict_invalid_header():
+    with pytest.raises(ValueError):
+        sip_headers_to_dict("ACK sip:user2@there.com SIP/2.0\r\nNot a header\r\n\r\n")
+    with pytest.raises(ValueError):
+        sip_headers_to_dict("ACK sip:user2@there.com SIP/2.0\r\nCall ID: 1\r\n\r\n")
+
+
+@pytest.mark.parametrize(
+    "header", ["Via: a\nEvil: b", "Via: a\rEvil: b", "Via: a\n", "Via:\nEvil: b"]
+)
+def test_sip_headers_to_dict_rejects_bare_cr_lf(header):
+    with pytest.raises(ValueError):
+        sip_headers_to_dict(f"ACK sip:user2@there.com SIP/2.0\r\n{header}\r\n\r\n")
+
+
 def test_generate_200_ok_response(shared_datadir):
     with open(shared_datadir / "sip" / "ACK.bin", "rb") as fh:
         packet = fh.read().decode("utf-8")